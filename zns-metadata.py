@@ -1,13 +1,17 @@
 from functools import partial
-import requests
-import re
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
-import json
+import orjson
+import ijson
 import asyncio
+import random
 import httpx
 import csv
 import os
-import aiometer
+import sqlite3
+from collections import Counter
+from contextlib import closing
 
 
 # Dev variables
@@ -19,8 +23,14 @@ QUERY_INFURA = False
 INFURA_PROJECT_ID = ''
 INFURA_PROJECT_SECRET = ''
 INFURA_IPFS_API_URL = 'https://ipfs.infura.io:5001/api/v0/cat'
+IPFS_PATH_PREFIX = 'ipfs://'
 INFURA_MAX_REQUESTS_PER_SEC = 10
+INFURA_MAX_RETRIES = 5
+INFURA_RETRY_STATUS_CODES = (429, 502, 503, 504) # 500 is used by the IPFS API for permanent errors
+IPFS_CACHE_FILE = 'ipfs_cache.sqlite'
 THEGRAPH_API_ENDPOINT = 'https://api.thegraph.com/subgraphs/name/zer0-os/zns'
+THEGRAPH_PAGE_SIZE = 1000
+THEGRAPH_PAGES_PER_ROUND = 10
 DOMAIN_GROUPS = [
     'wilder.wheels.genesis',
     'wilder.kicks.airwild.season0',
@@ -32,62 +42,86 @@ DOMAIN_GROUPS = [
     'wilder.cribs.wiami.southbeach.qube' ]
 
 
-def get_total_domains() -> int:
+async def get_total_domains(client: httpx.AsyncClient) -> int:
     """
     Queries the total number of zNS domains using official zer0-tech GraphQL API.
 
+    Parameters:
+        client (httpx.AsyncClient): An instance of the AsyncClient object to do asynchronous requests
+
     Returns:
         total_domains (int): The total number of zNS domains
     """
     query = '{ domains(first: 1, where: {indexId_not: null}, orderBy: indexId, orderDirection: desc) {indexId} }'
-    request = requests.post(
+    request = await client.post(
         THEGRAPH_API_ENDPOINT,
         json={'query': query}
     )
     if request.status_code == 200:
         request = request.json()
         total_domains = int(request['data']['domains'][0]['indexId'])
+    else:
+        raise Exception('Query failed. return code is {}. {}'.format(request.status_code, query))
     return total_domains
 
 
-def get_all_domains(maxId: int) -> list:
+async def get_domains_page(client: httpx.AsyncClient, lastId: int) -> list:
     """
-    Queries the data of all zNS domains (token id, domain id, domain name, IPFS path where metadata is stored). 
-    Official zer0-tech GraphQL API is used to retrieve all the data. It limits 1000 objects to be retrieved per query.
-    
+    Queries one page of zNS domains, i.e. all domains whose index is in the window ]lastId, lastId + THEGRAPH_PAGE_SIZE].
+    Pages are disjoint index ranges, so they don't depend on each other and can be queried concurrently.
+
     Parameters:
-        maxId (int): The total number of domains to query
+        client (httpx.AsyncClient): An instance of the AsyncClient object to do asynchronous requests
+        lastId (int): The index after which the page starts
+
+    Returns:
+        domains (list): A list of dictionnaries including the data about the zNS domains of the page
+    """
+    query = '''
+    {
+        domains(first: ''' f'{THEGRAPH_PAGE_SIZE}' ''', where: { indexId_gt: ''' f'{lastId}' ''', indexId_lte: ''' f'{lastId + THEGRAPH_PAGE_SIZE}' ''' }, orderBy: indexId, orderDirection: asc) {
+            id
+            indexId
+            name
+            metadata
+        }
+    }
+    '''
+    request = await client.post(THEGRAPH_API_ENDPOINT, json={'query': query})
+    if request.status_code == 200:
+        return request.json()['data']['domains']
+    else:
+        raise Exception('Query failed. return code is {}. {}'.format(request.status_code, query))
+
+
+async def get_all_domains() -> list:
+    """
+    Queries the data of all zNS domains (token id, domain id, domain name, IPFS path where metadata is stored). 
+    Official zer0-tech GraphQL API is used to retrieve all the data. It limits 1000 objects to be retrieved per query,
+    so THEGRAPH_PAGES_PER_ROUND pages are queried concurrently at each round. The total number of domains, which tells
+    how many rounds are needed, is queried at the same time as the first round, over the same connections.
 
     Returns: 
         result (list): A list of dictionnaries including the data about all zNS domains
     """
     results = []
-    lastId=0 # Used to query API by chunks of 1000
-    with tqdm(desc='Quering domains', total=maxId) as pbar:
-        while True:
-            query = '''
-            {
-                domains(first: 1000, where: { indexId_gt: ''' f'{lastId}' ''' }, orderBy: indexId, orderDirection: asc) {
-                    id
-                    indexId
-                    name
-                    metadata
-                }
-            }
-            '''
-            request = requests.post(THEGRAPH_API_ENDPOINT, json={'query': query})
-            if request.status_code == 200:
-                # If we get a response, update the cursor, format the response in JSON and calculate how many domains we retrieved
-                lastId = lastId + 1000
-                request = request.json()
-                entries_retrieved = len(request['data']['domains'])
-                if len(request['data']['domains']) <= 0: # If don't obtain any domain, we stop the loop and return what we got so far
-                    break
-                else:
-                    results.extend(request['data']['domains'])
-                    pbar.update(entries_retrieved) # Increase the progress bar by the number of domain which were returned to us
-            else:
-                raise Exception('Query failed. return code is {}. {}'.format(request.status_code, query))
+    round_size = THEGRAPH_PAGE_SIZE * THEGRAPH_PAGES_PER_ROUND
+    limits = httpx.Limits(max_connections=20, max_keepalive_connections=20)
+    async with httpx.AsyncClient(http2=True, limits=limits) as client:
+        # The first round doesn't depend on the total number of domains (pages after the last domain are just empty)
+        first_cursors = range(0, round_size, THEGRAPH_PAGE_SIZE)
+        maxId, *pages = await asyncio.gather(
+            get_total_domains(client),
+            *[get_domains_page(client, lastId) for lastId in first_cursors]
+        )
+        with tqdm(desc='Quering domains', total=maxId) as pbar:
+            for round_start in range(0, maxId, round_size): # Used to query API by rounds of pages of 1000
+                if round_start > 0:
+                    cursors = range(round_start, min(round_start + round_size, maxId), THEGRAPH_PAGE_SIZE)
+                    pages = await asyncio.gather(*[get_domains_page(client, lastId) for lastId in cursors])
+                for page in pages: # Pages are returned in the order of the cursors, so results stay sorted by index
+                    results.extend(page)
+                    pbar.update(len(page)) # Increase the progress bar by the number of domain which were returned to us
     return results
 
 
@@ -99,16 +133,10 @@ def check_for_duplicated_entries(data: list) -> list:
         data (list): A list of dictionnaries which have the key 'name'
 
     Returns:
-        duplicated (list): A list of entries which have been seen at least 2 times in the data
+        duplicated (list): A list of the names which have been seen at least 2 times in the data (each name is listed once)
     """
-    names = [z['name'] for z in data]
-    seen = set()
-    duplicated = []
-    for name in names:
-        if name not in seen:
-            seen.add(name)
-        else:
-            duplicated.append(name)
+    names = Counter(z['name'] for z in data)
+    duplicated = [name for name, count in names.items() if count > 1]
     return duplicated
 
 
@@ -120,8 +148,21 @@ def put_json_data_in_file(data: list, filename: str) -> None:
         data (list): A list of dictionnaries which can be serialized into JSON (not apostrophees sensitive)
         filename (str): The name of the file where the data will be written
     """
-    with open(filename, 'w') as f:
-        f.write(json.dumps(data))
+    with open(filename, 'wb') as f:
+        f.write(orjson.dumps(data))
+
+
+def put_ndjson_data_in_file(data: list, filename: str) -> None:
+    """
+    Outputs data into a file, one JSON object per line (NDJSON), so that it can be read back line by line.
+
+    Parameters:
+        data (list): A list of dictionnaries which can be serialized into JSON
+        filename (str): The name of the file where the data will be written
+    """
+    with open(filename, 'wb') as f:
+        for entry in data:
+            f.write(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE))
 
 
 def format_ipfs_hash_in_dicts(data: list) -> tuple:
@@ -136,62 +177,142 @@ def format_ipfs_hash_in_dicts(data: list) -> tuple:
     """
     # Replace 'ipfs://<hash>' by '<hash>' in 'metadata' field
     not_match = []
-    pattern = re.compile(re.escape('ipfs://'))
+    prefix_length = len(IPFS_PATH_PREFIX)
     for entry in data:
-        hash = re.sub(pattern, '', entry['metadata'])
-        if hash == entry['metadata']:
-            not_match.append(entry)
+        if entry['metadata'].startswith(IPFS_PATH_PREFIX):
+            entry['metadata'] = entry['metadata'][prefix_length:]
         else:
-            entry['metadata'] = hash
+            not_match.append(entry)
     return (data, not_match)
 
 
-async def get_metadata(session: httpx.AsyncClient, data: dict, pbar: tqdm = None) -> list:
+def open_ipfs_cache(filename: str) -> sqlite3.Connection:
+    """
+    Opens (and creates if needed) the on-disk cache of IPFS metadata, keyed by IPFS hash.
+    IPFS hashes are content-addressed, so a cached body never gets stale and no expiration is needed.
+    The cache uses a write-ahead log without a sync on each commit, so that storing a body doesn't block the event loop on disk flushes.
+
+    Parameters:
+        filename (str): The name of the SQLite file where the cache is stored
+
+    Returns:
+        cache (sqlite3.Connection): A connection to the cache database
+    """
+    cache = sqlite3.connect(filename)
+    cache.execute('PRAGMA journal_mode=WAL')
+    cache.execute('PRAGMA synchronous=NORMAL')
+    cache.execute('CREATE TABLE IF NOT EXISTS cache (cid TEXT PRIMARY KEY, body BLOB)')
+    return cache
+
+
+async def refill_tokens(tokens: asyncio.Queue, rate: int) -> None:
+    """
+    Token bucket limiting the number of requests per second: puts a token back in the queue every 1/'rate' second, waiting while the queue is full.
+    A request has to take a token from the queue before being sent, so requests are spread evenly instead of being sent in bursts,
+    as long as the queue only holds a few tokens. Runs until it is cancelled.
+
+    Parameters:
+        tokens (asyncio.Queue): The queue holding the available tokens
+        rate (int): The maximum number of requests per second
+    """
+    while True:
+        await tokens.put(None)
+        await asyncio.sleep(1 / rate)
+
+
+async def get_metadata(session: httpx.AsyncClient, cache: sqlite3.Connection, ipfs_hash: str, tokens: asyncio.Queue = None, pbar: tqdm = None) -> dict:
     """
-    Queries Infura API to retrieve metadata of a given zNS domain. It reads the IPFS hash in the 'metadata' field of the 'data' parameter.
-    Then it requests IPFS through Infura API to obtain the corresponding metadata, and puts the result into the 'metadata' field of the 'data' parameter.
-    At the beginning, the 'metadata' field contains the IPFS hash ; at the end it contains a dictionnary of the true metadata.
+    Queries Infura API to retrieve the metadata stored on IPFS at a given IPFS hash.
+    Metadata already stored in the cache are read from it instead of being requested again.
+    Requests failing with a transient status code or a transport error are retried up to INFURA_MAX_RETRIES times, waiting
+    for the delay given by the 'Retry-After' header if any, or else for an exponential backoff with jitter.
+    Other status codes, and the last failed attempt, raise an exception: an error body is never returned as metadata nor cached.
 
     Parameters:
         session (httpx.AsyncClient): An instance of the AsyncClient object to do asynchronous requests
-        data (dict): A dictionnary representing the zNS domain. It has to contain a 'metadata' field with an IPFS hash ('Qm...')
+        cache (sqlite3.Connection): A connection to the IPFS metadata cache, as returned by open_ipfs_cache
+        ipfs_hash (str): The IPFS hash where the metadata is stored ('Qm...')
+        tokens (asyncio.Queue): (optionnal) A queue filled by refill_tokens, a token is taken from it before requesting Infura
         pbar (tqdm): (optionnal) An instance to a tqdm progress bar which can be used to increment it
     Returns:
-        data (dict): The same dictionnary (parsed in JSON) which was passed as a parameter, but with the domain's metadata instead of the IPFS 
-            hash in the 'metadata' field.
+        metadata (dict): The metadata stored at the IPFS hash, parsed in JSON
     """
-    params = { 'arg': data['metadata'] }
-    response = await session.post(
-        INFURA_IPFS_API_URL, 
-        params=params, 
-        auth=(INFURA_PROJECT_ID, INFURA_PROJECT_SECRET)
-    )
-    response = response.json()
-    data['metadata'] = response
+    row = cache.execute('SELECT body FROM cache WHERE cid = ?', (ipfs_hash,)).fetchone()
+    if row is not None:
+        body = row[0]
+    else:
+        params = { 'arg': ipfs_hash }
+        for attempt in range(INFURA_MAX_RETRIES):
+            if tokens is not None:
+                await tokens.get()
+            backoff = min(2**attempt, 30) + random.random()
+            try:
+                response = await session.post(
+                    INFURA_IPFS_API_URL, 
+                    params=params, 
+                    auth=(INFURA_PROJECT_ID, INFURA_PROJECT_SECRET)
+                )
+            except httpx.TransportError: # Timeouts, dropped connections (e.g. HTTP/2 GOAWAY), ...
+                if attempt == INFURA_MAX_RETRIES - 1:
+                    raise
+                await asyncio.sleep(backoff)
+                continue
+            if response.status_code == 200:
+                break
+            elif response.status_code in INFURA_RETRY_STATUS_CODES and attempt < INFURA_MAX_RETRIES - 1:
+                retry_after = response.headers.get('Retry-After', '')
+                await asyncio.sleep(int(retry_after) if retry_after.isdigit() else backoff)
+            else:
+                raise Exception('Query failed. return code is {}. {}'.format(response.status_code, ipfs_hash))
+        body = response.content
+        if response.status_code == 200: # Only successful bodies are cached, an error must be requested again on the next run
+            with cache: # Commit right away so that already fetched metadata survive an interrupted run
+                cache.execute('INSERT OR IGNORE INTO cache (cid, body) VALUES (?, ?)', (ipfs_hash, body))
+    metadata = orjson.loads(body)
     if pbar is not None:
         pbar.update(1)
-    return data
+    return metadata
 
 
-async def get_all_metadata(data: list, maxId: int) -> list:
+async def get_all_metadata(data: list) -> list:
     """
     Retrieve metadata of all zNS domains represented by dictionnaries in a list.
+    Domains sharing the same IPFS hash share the same metadata, so each IPFS hash is only retrieved once.
+    A fixed number of workers take the IPFS hashes one by one, so there are never more than 'max_at_once' requests in progress,
+    and the requests to Infura are limited to 'max_per_second' by a token bucket.
 
     Parameters:
-        data (dict): A list of dictionnaries, where each dictionnary represents a zNS domain
-        maxId (int): The total number of zNS, in order to query the metadata for all of them
+        data (dict): A list of dictionnaries, where each dictionnary represents a zNS domain. The 'metadata' field of each
+            dictionnary has to contain an IPFS hash ; it is replaced by the corresponding metadata
 
     Returns:
         results (list): A list of all zNS domains with the corresponding metadata
     """
-    session = httpx.AsyncClient()
-    results = []
-    with tqdm(total=maxId, desc='Retrieving metadata') as pbar:
-        results = await aiometer.run_all(
-            [partial(get_metadata, session, entry, pbar) for entry in data], 
-            max_per_second=50,
-            max_at_once=100
-        )
+    max_per_second = 50
+    max_at_once = 100
+    metadata = {entry['metadata']: None for entry in data}
+    ipfs_hashes = iter(list(metadata)) # Shared by all workers, each IPFS hash is taken by only one of them
+    tokens = asyncio.Queue(maxsize=1) # A single token can be saved up, so the limit holds over any one-second window
+
+    async def worker():
+        for ipfs_hash in ipfs_hashes:
+            metadata[ipfs_hash] = await get_metadata(session, cache, ipfs_hash, tokens, pbar)
+
+    # Keep connections to Infura alive between requests, so the TLS handshake is only done once per connection
+    limits = httpx.Limits(max_connections=100, max_keepalive_connections=100, keepalive_expiry=60)
+    timeout = httpx.Timeout(30.0, connect=5.0)
+    # Connection failures are retried by the transport, transport errors and failed responses are retried by get_metadata
+    transport = httpx.AsyncHTTPTransport(http2=True, limits=limits, retries=3)
+    async with httpx.AsyncClient(transport=transport, timeout=timeout) as session:
+        with closing(open_ipfs_cache(IPFS_CACHE_FILE)) as cache, tqdm(total=len(metadata), desc='Retrieving metadata') as pbar:
+            refill = asyncio.create_task(refill_tokens(tokens, max_per_second))
+            try:
+                await asyncio.gather(*[worker() for _ in range(max_at_once)])
+            finally:
+                refill.cancel()
+    for entry in data:
+        entry['metadata'] = metadata[entry['metadata']]
+    results = data
     return results
 
 
@@ -208,19 +329,25 @@ def separate_industries_into_files(data: list, domain_groups: list) -> None:
     final_directory = os.path.join(current_directory, r'industries')
     if not os.path.exists(final_directory):
         os.makedirs(final_directory)
-    for domain_group in domain_groups:
-        current_group = []
-        for entry in data:
-            pattern = re.compile(re.escape(domain_group) + r'\.[^.]+$')
-            if re.search(pattern, entry['name']):
-                current_group.append({'tokenId':entry['id'], 'domain':entry['name'], 'metadata':entry['metadata']})
-        put_json_data_in_file(current_group, os.path.join(final_directory, domain_group))
+    final_directory_prefix = final_directory + os.sep # Industry files are directly under it, no need to join paths for each of them
+    # A direct child of a domain group is the group name, a dot, and a last label without any dot: removing the last label
+    # of a domain name gives the only group it can belong to, which is looked up directly
+    groups = {domain_group: [] for domain_group in domain_groups}
+    for entry in data:
+        name = entry['name']
+        parent, _, label = name.rpartition('.')
+        current_group = groups.get(parent)
+        if current_group is not None and label:
+            current_group.append({'tokenId':entry['id'], 'domain':name, 'metadata':entry['metadata']})
+    for domain_group, current_group in groups.items():
+        put_json_data_in_file(current_group, final_directory_prefix + domain_group)
 
 
 def flatten(input_dict, separator='.', prefix='') -> dict:
     """
     Flatten a dictionnary by unnesting subdictionnaries and sublists. Keys are transformed in a string of subkeys separated by a dot.
-    Example : input = {'a': 'b', 'c': [{'d': 'e'}, {'f', 'g'}]} Output = {'a': 'b', 'c.0.d': 'e', 'c.1.f': 'g'}
+    List indexes start at 1. Empty subdictionnaries and sublists are kept as values.
+    Example : input = {'a': 'b', 'c': [{'d': 'e'}, 'f']} Output = {'a': 'b', 'c.1.d': 'e', 'c.2': 'f'}
 
     Parameters:
         input_dict (dict): A dictionnary to be flatten
@@ -231,39 +358,66 @@ def flatten(input_dict, separator='.', prefix='') -> dict:
         output_dict (dict): The dictionnary flattenned
     """
     output_dict = {}
-    for key, value in input_dict.items():
+    # Nodes to visit with the path of subkeys leading to them. Children are pushed in reverse order so that they are popped
+    # in their original order, and the keys of the output keep the order of the input.
+    stack = [((key,), value) for key, value in reversed(input_dict.items())]
+    while stack:
+        path, value = stack.pop()
         if isinstance(value, dict) and value:
-            deeper = flatten(value, separator, prefix+key+separator)
-            output_dict.update({key2: val2 for key2, val2 in deeper.items()})
+            stack.extend(((*path, key), subvalue) for key, subvalue in reversed(value.items()))
         elif isinstance(value, list) and value:
-            for index, sublist in enumerate(value, start=1):
-                if isinstance(sublist, dict) and sublist:
-                    deeper = flatten(sublist, separator, prefix+key+separator+str(index)+separator)
-                    output_dict.update({key2: val2 for key2, val2 in deeper.items()})
-                else:
-                    output_dict[prefix+key+separator+str(index)] = value
+            stack.extend(((*path, str(index)), sublist) for index, sublist in reversed(list(enumerate(value, start=1))))
         else:
-            output_dict[prefix+key] = value
+            output_dict[prefix + separator.join(path)] = value
     return output_dict
 
 
 def put_json_to_csv_in_file(data, filename) -> None:
     """
-    Put a list of dictionnary into a file. All dictionnaries must have the same keys.
+    Put a list of dictionnary into a file. Columns are all the keys seen in the dictionnaries, in the order they are first seen ;
+    a dictionnary which misses a key gets an empty value in that column. Nothing is written if the list is empty.
 
     Parameters:
         data (list): A list of dictionnary to put in the file, where each dictionnary represents a line and each dict key a CSV column.
         filename (str): The name of the file to put the data into
     """
-    with open(filename, 'w') as f:
-        csv_writer = csv.writer(f)
-        count = 0
-        for entry in data:
-            if count == 0:
-                header = entry.keys()
-                csv_writer.writerow(header)
-                count += 1
-            csv_writer.writerow(entry.values())
+    if not data:
+        return
+    header = list(dict.fromkeys(key for entry in data for key in entry))
+    with open(filename, 'w', newline='', buffering=1<<20) as f:
+        csv_writer = csv.DictWriter(f, fieldnames=header)
+        csv_writer.writeheader()
+        csv_writer.writerows(data)
+
+
+def process_industry(domain: str, industries_dir: str, csv_dir: str) -> None:
+    """
+    Reads the file of an industry written by separate_industries_into_files, transforms and flattens its domains,
+    and outputs them sorted by domain name into a CSV file.
+
+    Parameters:
+        domain (str): The zNS domain name of the industry, which is also the name of its file
+        industries_dir (str): The directory where the industry files are read from
+        csv_dir (str): The directory where the CSV file is written
+    """
+    results = []
+    # Stream the domains from the file one by one, so that only their flattened version is kept in memory
+    with open(os.path.join(industries_dir, domain), 'rb') as f:
+        for i in ijson.items(f, 'item', use_float=True):
+            # Transform attributes into a single dictionnary of trait values, sorted by trait type
+            attributes = i['metadata']['attributes']
+            i['metadata']['attributes'] = {z['trait_type']: z['value'] for z in sorted(attributes, key=itemgetter('trait_type'))}
+            # Flatten the domain
+            results.append(flatten(i))
+
+    # Sort the results by domain name
+    results.sort(key=itemgetter('domain'))
+
+    # Output in flatten dir
+    #put_json_data_in_file(results, os.path.join(flatten_dir, domain))
+
+    # Output in CSV format
+    put_json_to_csv_in_file(results, os.path.join(csv_dir, domain))
 
 
 def main():
@@ -278,16 +432,13 @@ def main():
     #flatten_dir = os.path.join(current_dir, r'industries_flatten')
     csv_dir = os.path.join(current_dir, r'industries_csv')
 
-    # Get total domains to retrieve
-    total_domains = get_total_domains()
-
-    # Query all domains through TheGraph API
+    # Query all domains through TheGraph API, or reuse the ones saved by a previous run
     if QUERY_THEGRAPH == True:
-        data = get_all_domains(total_domains)
+        data = asyncio.run(get_all_domains())
         put_json_data_in_file(data, FILE_RAW_OUTPUT)
     else:
-        with open(FILE_RAW_OUTPUT, 'r') as f:
-            data = json.load(f)
+        with open(FILE_RAW_OUTPUT, 'rb') as f:
+            data = orjson.loads(f.read())
             print(f"All domains retrieved in file '{f.name}'.")
 
     # Check if there is any duplicated entries
@@ -298,14 +449,17 @@ def main():
     # Replace IPFS paths by IPFS hashes and store data without paths in a file
     data, not_match = format_ipfs_hash_in_dicts(data)
     put_json_data_in_file(not_match, FILE_DOMAINS_WITHOUT_METADATA)
+    # Domains without an IPFS hash have no metadata to retrieve, so they are left out of the next steps
+    not_match_ids = {id(entry) for entry in not_match}
+    data = [entry for entry in data if id(entry) not in not_match_ids]
 
-    # Retrieve metadata from IPFS hashes through Infura
+    # Retrieve metadata from IPFS hashes through Infura, or reuse the ones saved by a previous run
     if QUERY_INFURA == True:
-        data = asyncio.run(get_all_metadata(data, total_domains))
-        put_json_data_in_file(data, FILE_DOMAINS_WITH_METADATA)
+        data = asyncio.run(get_all_metadata(data))
+        put_ndjson_data_in_file(data, FILE_DOMAINS_WITH_METADATA)
     else:
-        with open(FILE_DOMAINS_WITH_METADATA, 'r') as f:
-            data = json.load(f)
+        with open(FILE_DOMAINS_WITH_METADATA, 'rb') as f:
+            data = [orjson.loads(line) for line in f]
             print(f"All metadata retrieved in file '{f.name}'.")
 
     # Output items into different files, each one corresponding to an industry
@@ -315,29 +469,9 @@ def main():
     # Process all industry files
     if not os.path.exists(csv_dir):
         os.makedirs(csv_dir)
-    for domain in DOMAIN_GROUPS:
-        results = []
-        with open(os.path.join(industries_dir, domain), 'r') as f:
-            data = json.load(f)
-            # Transform attributes
-            for i in data:
-                attributes = i['metadata']['attributes']
-                attributes = sorted(attributes, key=lambda d: d['trait_type'])
-                attributes = [{z['trait_type']:z['value']} for z in attributes]
-                i['metadata']['attributes'] = attributes
-                results.append(i)
-
-            # Flatten all industries and put the results in files
-            results = [flatten(i) for i in results]
-
-            # Sort the results by domain name
-            results = sorted(results, key=lambda d: d['domain'])
-
-            # Output in flatten dir
-            #put_json_data_in_file(results, os.path.join(flatten_dir, domain))
-
-            # Output in CSV format
-            put_json_to_csv_in_file(results, os.path.join(csv_dir, domain))
+    # Industries are independent from each other, so each one is processed in its own process
+    with ProcessPoolExecutor(max_workers=min(len(DOMAIN_GROUPS), os.cpu_count() or 1)) as executor:
+        list(executor.map(partial(process_industry, industries_dir=industries_dir, csv_dir=csv_dir), DOMAIN_GROUPS))
 
 
     # Compare wheels